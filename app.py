@@ -3,10 +3,24 @@ import time
 import random
 import threading
 import streamlit as st
-from matching import process_files, PARTIAL_SIMILARITY_THRESHOLD
+from streamlit.runtime.scriptrunner import add_script_run_ctx
+from matching import process_files, build_master_index, PARTIAL_SIMILARITY_THRESHOLD
 
 st.set_page_config("Fund Name Validator", layout="centered")
 
+
+# ── Master index cache ──────────────────────────────────
+# Reruns with the same master file (new output file, new threshold) skip
+# re-reading and re-indexing it; a changed master file hashes differently.
+# cache_resource hands back the same object without pickling it (cache_data
+# would pickle on store and unpickle on every hit, most of the build cost again);
+# safe because process_files never mutates the index.
+# An index is many times the size of its file and this cache is shared by every
+# session, so only the latest master is kept, and only for an hour.
+@st.cache_resource(show_spinner=False, max_entries=1, ttl=3600)
+def cached_master_index(master_bytes, master_filename):
+    return build_master_index(master_bytes, master_filename)
+
 # ── Funny loading messages ───────────────────────────────
 LOADING_MESSAGES = [
     "Sit back, relax — we've got this ☕",
@@ -212,6 +226,22 @@ if run_clicked and master_file and output_file:
     master_bytes = master_file.read()
     output_bytes = output_file.read()
 
+    # Single random message for the entire run
+    # Loading bar renders into results_slot — same placeholder as stats,
+    # so it appears ABOVE the run button from the moment the user clicks
+    run_msg = random.choice(LOADING_MESSAGES)
+
+    def show_loading(pct, caption):
+        results_slot.markdown(f"""
+        <div class="fnv-loading">
+          <div class="fnv-loading-msg">{run_msg}</div>
+          <div class="fnv-progress-bar-bg">
+            <div class="fnv-progress-bar-fill" style="width:{pct}%"></div>
+          </div>
+          <div class="fnv-loading-pct">{caption}</div>
+        </div>
+        """, unsafe_allow_html=True)
+
     result_container = {"done": False, "result": None, "error": None}
 
     def run_matching():
@@ -219,47 +249,31 @@ if run_clicked and master_file and output_file:
             result_container["result"] = process_files(
                 master_bytes, output_bytes,
                 master_file.name, output_file.name,
-                similarity_threshold=threshold
+                similarity_threshold=threshold,
+                master_index=cached_master_index(master_bytes, master_file.name)
             )
         except Exception as e:
             result_container["error"] = str(e)
         finally:
             result_container["done"] = True
 
+    # The thread gets this run's ScriptRunContext, which the cached call needs;
+    # the loading bar below keeps moving while a cold master is indexed
     thread = threading.Thread(target=run_matching)
+    add_script_run_ctx(thread)
     thread.start()
 
-    # Single random message for the entire run
-    # Loading bar renders into results_slot — same placeholder as stats,
-    # so it appears ABOVE the run button from the moment the user clicks
-    run_msg = random.choice(LOADING_MESSAGES)
     tick = 0
     FAKE_DURATION = 8
 
     while not result_container["done"]:
         pct = min(int((tick / FAKE_DURATION) * 90), 90)
-        results_slot.markdown(f"""
-        <div class="fnv-loading">
-          <div class="fnv-loading-msg">{run_msg}</div>
-          <div class="fnv-progress-bar-bg">
-            <div class="fnv-progress-bar-fill" style="width:{pct}%"></div>
-          </div>
-          <div class="fnv-loading-pct">{pct}% done — hang tight…</div>
-        </div>
-        """, unsafe_allow_html=True)
+        show_loading(pct, f"{pct}% done — hang tight…")
         time.sleep(1)
         tick += 1
 
     # Snap to 100% then let results overwrite this slot
-    results_slot.markdown(f"""
-    <div class="fnv-loading">
-      <div class="fnv-loading-msg">{run_msg}</div>
-      <div class="fnv-progress-bar-bg">
-        <div class="fnv-progress-bar-fill" style="width:100%"></div>
-      </div>
-      <div class="fnv-loading-pct">100% done.</div>
-    </div>
-    """, unsafe_allow_html=True)
+    show_loading(100, "100% done.")
     time.sleep(0.6)
 
     if result_container["error"]:
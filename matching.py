@@ -1,23 +1,51 @@
 # matching.py
 import re
+import sys
 import time
+import zipfile
+import numpy as np
 import pandas as pd
 from io import BytesIO
-from openpyxl import load_workbook
-from openpyxl.styles import PatternFill
+from bisect import bisect_left
 from collections import defaultdict
+from collections.abc import Sequence
+from rapidfuzz import process
+from rapidfuzz.distance import Indel
 
 # ---------- Similarity threshold for partial match ----------
 # Word-level Jaccard similarity must be >= this value to qualify as Partial.
 # Keeps false positives like "Fund IV" vs "Fund I" or missing prefixes as No Match.
 PARTIAL_SIMILARITY_THRESHOLD = 0.75
 
+# Partial matching scans this many eligible candidates per row in Python; any
+# beyond it are scored together in one RapidFuzz call (cheaper for long lists).
+BATCH_SCORE_MIN_CANDIDATES = 32
+
+# An (lp, cons) group with at least this many partial-match queries is scored as
+# one queries x candidates RapidFuzz matrix instead of query by query.
+GROUP_BATCH_MIN_QUERIES = 16
+GROUP_BATCH_MAX_CELLS   = 2_000_000  # matrix cells per cdist call (bounds memory)
+
 # Stopwords excluded from word overlap calculation
 STOPWORDS = {"fund", "the", "of", "and", "a", "an", "for", "by", "in", "at"}
 
+# ---------- Log line templates ----------
+# The row loop records (template, row, ...) events; LogLines formats them when read.
+LOG_EXACT           = "Row %d | Exact -> %s"
+LOG_PARTIAL_LP      = "Row %d | Partial (LP mismatch) -> %s"
+LOG_PARTIAL_SIMILAR = "Row %d | Partial (similarity=%.2f) -> %s"
+LOG_NO_MATCH        = "Row %d | No Match"
+
+# ---------- Precompiled patterns (shared by the scalar and vectorized helpers) ----------
+WHITESPACE_RE     = re.compile(r'\s+')
+LP_LLC_SUFFIX_RE  = re.compile(r'[\s,]*(l\.?p\.?|l\.?l\.?c\.?)[\s.,]*$', re.IGNORECASE)
+TRAILING_PUNCT_RE = re.compile(r'[,.\s]+$')
+LP_LLC_RE         = re.compile(r'\b(?:l\.?p\.?|l\.?l\.?c\.?)\b', re.IGNORECASE)
+TOKEN_RE          = re.compile(r'[a-z0-9]+')
+
 # ---------- Normalization helpers ----------
 def collapse_spaces(s: str) -> str:
-    return re.sub(r'\s+', ' ', s).strip()
+    return WHITESPACE_RE.sub(' ', s).strip()
 
 def normalize_lp_cons(val):
     if val is None:
@@ -34,30 +62,250 @@ def normalize_fund(val):
 
 def strip_lp_llc(s: str) -> str:
     """Remove LP/L.P./LLC/L.L.C from end of fund name, then clean trailing commas/punctuation."""
-    s = re.sub(r'[\s,]*(l\.?p\.?|l\.?l\.?c\.?)[\s.,]*$', '', s, flags=re.IGNORECASE).strip()
-    s = re.sub(r'[,.\s]+$', '', s).strip()
+    s = LP_LLC_SUFFIX_RE.sub('', s).strip()
+    s = TRAILING_PUNCT_RE.sub('', s).strip()
     return s
 
 def has_lp_llc(s: str) -> bool:
     """Check if fund name contains LP or LLC (in any common format)."""
-    return bool(re.search(r'\b(l\.?p\.?|l\.?l\.?c\.?)\b', s, flags=re.IGNORECASE))
+    return bool(LP_LLC_RE.search(s))
 
 def tokenize(s: str) -> list:
     """Split into lowercase alphanumeric tokens, excluding stopwords."""
-    tokens = re.findall(r'[a-z0-9]+', s.lower())
+    tokens = TOKEN_RE.findall(s.lower())
     return [t for t in tokens if t not in STOPWORDS]
 
-def word_jaccard(a: str, b: str) -> float:
-    """
-    Word-level Jaccard similarity between two strings.
-    Jaccard = |intersection| / |union| of unique word sets.
-    Returns 0.0 if either string is empty.
-    """
-    sa, sb = set(tokenize(a)), set(tokenize(b))
+def set_jaccard(sa, sb) -> float:
+    """Word-level Jaccard |A & B| / |A | B| of two pre-tokenized word sets (0.0 if either is empty)."""
     if not sa or not sb:
         return 0.0
     return len(sa & sb) / len(sa | sb)
 
+def token_id_sequence(s: str, token_ids: dict) -> tuple:
+    """Sorted, duplicate-free tuple of integer token ids for s (new tokens get the next id)."""
+    return tuple(sorted({token_ids.setdefault(t, len(token_ids)) for t in tokenize(s)}))
+
+def batch_jaccard(query: tuple, choices: list) -> np.ndarray:
+    """
+    set_jaccard of one token_id_sequence against many, scored in a single RapidFuzz call.
+    For sorted, duplicate-free sequences the longest common subsequence is the set
+    intersection, so Indel distance = |A| + |B| - 2|A & B| and the exact Jaccard
+    falls out of it (same value as set_jaccard on the equivalent sets).
+    """
+    if not query:
+        return np.zeros(len(choices))
+    distances = process.cdist([query], choices, scorer=Indel.distance, dtype=np.int32)[0]
+    lengths   = len(query) + np.fromiter(map(len, choices), dtype=np.int32, count=len(choices))
+    inter     = (lengths - distances) // 2
+    return inter / (lengths - inter)
+
+# ---------- Vectorized (whole-column) equivalents ----------
+# Same results as the scalar helpers above, but run once per column through
+# the pandas .str accessor instead of one Python call per cell.
+# Columns are held as object dtype so .str runs Python's own str methods and re;
+# pandas 3's default str dtype runs Arrow kernels instead, which lowercase
+# ("İ") and match \b differently.
+def as_object_str(col: pd.Series) -> pd.Series:
+    """NaN -> "", every value as a Python str in an object-dtype Series."""
+    return col.fillna("").astype(str).astype(object)
+
+def normalize_lp_cons_series(col: pd.Series) -> pd.Series:
+    """Column-wise normalize_lp_cons: NaN -> "", collapse whitespace, lowercase."""
+    return (as_object_str(col)
+               .str.replace(WHITESPACE_RE, " ", regex=True)
+               .str.strip()
+               .str.lower())
+
+def normalize_fund_series(col: pd.Series) -> pd.Series:
+    """Column-wise normalize_fund. Does NOT strip LP/LLC (see strip_lp_llc_series)."""
+    return normalize_lp_cons_series(col)
+
+def strip_lp_llc_series(col: pd.Series) -> pd.Series:
+    """Column-wise strip_lp_llc on already-normalized fund names."""
+    return (col.str.replace(LP_LLC_SUFFIX_RE, "", regex=True)
+               .str.strip()
+               .str.replace(TRAILING_PUNCT_RE, "", regex=True)
+               .str.strip())
+
+def has_lp_llc_series(col: pd.Series) -> pd.Series:
+    """Column-wise has_lp_llc."""
+    return as_object_str(col).str.contains(LP_LLC_RE, regex=True)
+
+# ---------- Integer key encoding ----------
+def factorize_master(values):
+    """
+    Factorize master values. Returns (ids, index): ids are int64 positions into
+    index, which holds each distinct value once.
+    """
+    ids, uniques = pd.factorize(pd.Series(values, dtype=object))
+    return ids, pd.Index(uniques, dtype=object)
+
+def lookup_ids(index: pd.Index, values) -> np.ndarray:
+    """Ids of output values in a master index from factorize_master; -1 where master lacks the value."""
+    return index.get_indexer(pd.Series(values, dtype=object))
+
+def encode_keys(lp_ids, cons_ids, fund_ids, has_lp, n_cons, n_fund):
+    """
+    Pack factorized ids into single integer keys (mixed radix, so no collisions).
+    Returns (group_keys, exact_keys) as lists of Python ints:
+    - group key: (lp, cons)
+    - exact key: (lp, cons, stripped fund, LP/LLC presence)
+    An id of -1 (value not in master) gives key -1, which matches no master key.
+    """
+    known_group = (lp_ids >= 0) & (cons_ids >= 0)
+    group_keys  = np.where(known_group, lp_ids * n_cons + cons_ids, -1)
+    exact_keys  = np.where(
+        known_group & (fund_ids >= 0),
+        (group_keys * n_fund + fund_ids) * 2 + np.asarray(has_lp, dtype=np.int64),
+        -1,
+    )
+    return group_keys.tolist(), exact_keys.tolist()
+
+# ---------- Partial matching ----------
+def find_partial_match(f_stripped, f_has_lp, f_fund_id, f_tokens, f_token_set,
+                       candidates, postings, similarity_threshold):
+    """
+    First candidate, in master order, that qualifies as a Partial match for one output fund.
+    Returns (matched original fund, similarity) or None; similarity is None for Case A.
+
+    candidates: the (lp, cons) group's parallel lists (strippeds, has_lps, token_sets, token_seqs, fund_origs)
+    postings:   the group's ({token id: [positions]}, {stripped fund id: first position})
+    """
+    token_postings, stripped_first = postings
+    cand_strippeds, cand_has_lps, cand_token_sets, cand_token_seqs, cand_origs = candidates
+    if similarity_threshold > 0:
+        # Only candidates sharing a token (Jaccard > 0) or the same stripped name can
+        # qualify. They are visited in master order so the first hit wins, exactly
+        # as a full scan would.
+        eligible = set()
+        for tok in f_tokens:
+            eligible.update(token_postings.get(tok, ()))
+        # Jaccard is at most min(|A|, |B|) / max(|A|, |B|), so candidates whose token
+        # count cannot reach the threshold are dropped (checked once per distinct count)
+        n_tokens  = len(f_tokens)
+        count_fits = {}
+        for pos in eligible:
+            length = len(cand_token_seqs[pos])
+            if length not in count_fits:
+                count_fits[length] = min(length, n_tokens) / max(length, n_tokens) >= similarity_threshold
+        eligible = {pos for pos in eligible if count_fits[len(cand_token_seqs[pos])]}
+        if f_fund_id in stripped_first:
+            eligible.add(stripped_first[f_fund_id])
+        positions = sorted(eligible)
+    else:
+        positions = range(len(cand_strippeds))
+
+    # Most hits sit near the front, so the head is scanned in plain Python
+    head = positions[:BATCH_SCORE_MIN_CANDIDATES]
+    for pos in head:
+        cand_stripped = cand_strippeds[pos]
+
+        # Case A: LP/LLC mismatch only — stripped names are identical, LP presence differs
+        if f_stripped and cand_stripped and f_stripped == cand_stripped and f_has_lp != cand_has_lps[pos]:
+            return cand_origs[pos], None
+
+        # Case B: Word-overlap similarity >= threshold (replaces loose substring match)
+        # Uses stripped names so LP/LLC tokens don't inflate the score
+        similarity = set_jaccard(f_token_set, cand_token_sets[pos])
+        if similarity >= similarity_threshold:
+            return cand_origs[pos], similarity
+
+    # Long tail: score the rest in one RapidFuzz call and take the first that wins,
+    # Case A included (it is checked before similarity at its own position)
+    tail = positions[len(head):]
+    if not tail:
+        return None
+    scores = batch_jaccard(f_tokens, [cand_token_seqs[pos] for pos in tail])
+    hits   = np.flatnonzero(scores >= similarity_threshold)
+    first  = int(hits[0]) if len(hits) else len(tail)
+
+    pos_a = stripped_first.get(f_fund_id)
+    if f_stripped and pos_a is not None and pos_a >= tail[0]:
+        k_a = bisect_left(tail, pos_a)
+        if k_a <= first and cand_has_lps[pos_a] != f_has_lp:
+            return cand_origs[pos_a], None
+
+    if first == len(tail):
+        return None
+    return cand_origs[tail[first]], float(scores[first])
+
+def match_group_queries(queries, candidates, postings, similarity_threshold):
+    """
+    find_partial_match for many queries against one (lp, cons) group, same results.
+    Every query is scored against every candidate in one process.cdist call (Indel
+    distance on token id sequences, as in batch_jaccard); the first candidate at or
+    above the threshold wins, unless the Case A candidate comes no later.
+    """
+    cand_strippeds, cand_has_lps, cand_token_sets, cand_token_seqs, cand_origs = candidates
+    stripped_first = postings[1]
+    n_cands    = len(cand_token_seqs)
+    cand_lens  = np.fromiter(map(len, cand_token_seqs), dtype=np.int32, count=n_cands)
+    chunk_size = max(1, GROUP_BATCH_MAX_CELLS // max(n_cands, 1))
+
+    matches = []
+    for start in range(0, len(queries), chunk_size):
+        chunk      = queries[start:start + chunk_size]
+        query_seqs = [query[3] for query in chunk]
+        # workers=-1: RapidFuzz spreads the matrix rows over every core in native threads
+        distances  = process.cdist(query_seqs, cand_token_seqs, scorer=Indel.distance,
+                                   dtype=np.int32, workers=-1)
+        lengths = np.fromiter(map(len, query_seqs), dtype=np.int32, count=len(chunk))[:, None] + cand_lens
+        inter   = (lengths - distances) // 2
+        union   = lengths - inter
+        union[union == 0] = 1  # both empty: intersection 0, so similarity 0.0 like set_jaccard
+        scores  = inter / union
+        hits    = scores >= similarity_threshold
+        firsts  = np.where(hits.any(axis=1), hits.argmax(axis=1), n_cands).tolist()
+
+        for row, (f_stripped, f_has_lp, f_fund_id, _, _, _) in enumerate(chunk):
+            first = firsts[row]
+            pos_a = stripped_first.get(f_fund_id) if f_stripped else None
+            if pos_a is not None and pos_a <= first and cand_has_lps[pos_a] != f_has_lp:
+                matches.append((cand_origs[pos_a], None))
+            elif first < n_cands:
+                matches.append((cand_origs[first], float(scores[row, first])))
+            else:
+                matches.append(None)
+    return matches
+
+def match_partial_queries(queries, funds_by_lp_cons, postings_by_lp_cons, similarity_threshold):
+    """
+    Partial match for each query, in order. Queries are grouped by (lp, cons); groups
+    with at least GROUP_BATCH_MIN_QUERIES of them go through match_group_queries,
+    the rest through find_partial_match one by one.
+    A query is (f_stripped, f_has_lp, f_fund_id, f_tokens, f_token_set, group_key).
+    """
+    rows_by_group = defaultdict(list)
+    for row, query in enumerate(queries):
+        rows_by_group[query[5]].append(row)
+
+    matches = [None] * len(queries)
+    for group_key, rows in rows_by_group.items():
+        candidates = funds_by_lp_cons[group_key]
+        postings   = postings_by_lp_cons[group_key]
+        if len(rows) >= GROUP_BATCH_MIN_QUERIES:
+            group_matches = match_group_queries(
+                [queries[row] for row in rows], candidates, postings, similarity_threshold
+            )
+        else:
+            group_matches = [
+                find_partial_match(*queries[row][:5], candidates, postings, similarity_threshold)
+                for row in rows
+            ]
+        for row, match in zip(rows, group_matches):
+            matches[row] = match
+    return matches
+
+def normalize_unique(col: pd.Series, normalizer) -> pd.Series:
+    """
+    Run a column-wise helper on the distinct values of col only and map the results
+    back. Normalization is pure, and LP/consultant (often fund) columns repeat the
+    same few names across thousands of rows.
+    """
+    col     = col.fillna("").astype(str)
+    uniques = pd.Series(col.unique(), dtype=object)
+    return col.map(dict(zip(uniques, normalizer(uniques))))
+
 def find_column_ignore_case(df, target_lower):
     for col in df.columns:
         if str(col).strip().lower() == target_lower:
@@ -68,21 +316,297 @@ def read_uploaded(uploaded_bytes: bytes, filename: str):
     """Read uploaded file (CSV or Excel) into a DataFrame"""
     buffer = BytesIO(uploaded_bytes)
     if filename.lower().endswith(".csv"):
+        # The C parser with dtype=str keeps every cell as its raw text ("007",
+        # "1.50", long IDs); pyarrow's engine infers a type first and rewrites them
         try:
             return pd.read_csv(buffer, dtype=str, encoding="utf-8")
         except UnicodeDecodeError:
             buffer.seek(0)  # reset pointer
             return pd.read_csv(buffer, dtype=str, encoding="latin1")
     else:
-        return pd.read_excel(buffer, dtype=str)
+        # calamine parses xlsx in Rust; read-only, so no need for openpyxl here
+        return pd.read_excel(buffer, dtype=str, engine="calamine")
+
+# ---------- Streaming xlsx writer ----------
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+SPREADSHEET_NS  = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+OFFICE_REL_NS   = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PACKAGE_REL_NS  = "http://schemas.openxmlformats.org/package/2006/relationships"
+XLSX_MIME       = "application/vnd.openxmlformats-officedocument.spreadsheetml"
+
+# Characters XML 1.0 cannot carry, plus \r (XML parsers fold it into \n);
+# Excel reads them back from _xHHHH_ escapes
+XML_CONTROL_CHARS_RE = re.compile(r'[\x00-\x08\x0b-\x1f\ufffe\uffff]')
+# Underscores that would make literal text read back as an escape ("_x0041_" -> "A")
+XML_ESCAPE_LIKE_RE   = re.compile(r'_(?=x[0-9A-Fa-f]{4}_)')
+EXCEL_MAX_STRING_LEN = 32767
+
+# DEFLATE level for the result xlsx. The sheet XML is highly repetitive, so
+# level 1 compresses almost as well as zlib's default 6 in well under the time.
+XLSX_COMPRESS_LEVEL = 1
+
+def xml_text(value) -> str:
+    """Escape a cell value for an inline-string <t> element (Excel's length limit applied)."""
+    text = str(value)[:EXCEL_MAX_STRING_LEN]
+    text = text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+    if "_x" in text:
+        text = XML_ESCAPE_LIKE_RE.sub("_x005F_", text)
+    return XML_CONTROL_CHARS_RE.sub(lambda m: "_x%04X_" % ord(m.group()), text)
+
+def column_letter(index: int) -> str:
+    """0-based column index -> Excel column letters (0 -> A, 26 -> AA)."""
+    letters = ""
+    index  += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+class StreamingSheetWriter:
+    """
+    Minimal one-sheet xlsx writer for the result file. Every value is written as
+    text; cells carry a solid fill, the header style or no style. Rows are
+    formatted straight to XML strings and streamed into the zip in batches, so no
+    per-cell objects are created and memory stays flat.
+    """
+    FLUSH_ROWS = 2000
+
+    def __init__(self, buffer, fill_colors):
+        # cellXfs ids: 0 is the unfilled default, fill_styles[i] uses fill_colors[i],
+        # header_style is pandas' to_excel header (bold, thin border, centred)
+        self.fill_styles  = tuple(range(1, len(fill_colors) + 1))
+        self.header_style = len(fill_colors) + 1
+        self._style_attrs = [""] + [f' s="{style}"' for style in range(1, self.header_style + 1)]
+
+        fills = "".join(
+            f'<fill><patternFill patternType="solid"><fgColor rgb="FF{color}"/><bgColor indexed="64"/></patternFill></fill>'
+            for color in fill_colors
+        )
+        fill_xfs = "".join(
+            f'<xf numFmtId="0" fontId="0" fillId="{fill_id}" borderId="0" xfId="0" applyFill="1"/>'
+            for fill_id in range(2, len(fill_colors) + 2)
+        )
+        parts = {
+            "[Content_Types].xml": (
+                '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                '<Default Extension="xml" ContentType="application/xml"/>'
+                f'<Override PartName="/xl/workbook.xml" ContentType="{XLSX_MIME}.sheet.main+xml"/>'
+                f'<Override PartName="/xl/worksheets/sheet1.xml" ContentType="{XLSX_MIME}.worksheet+xml"/>'
+                f'<Override PartName="/xl/styles.xml" ContentType="{XLSX_MIME}.styles+xml"/>'
+                '</Types>'
+            ),
+            "_rels/.rels": (
+                f'<Relationships xmlns="{PACKAGE_REL_NS}">'
+                f'<Relationship Id="rId1" Type="{OFFICE_REL_NS}/officeDocument" Target="xl/workbook.xml"/>'
+                '</Relationships>'
+            ),
+            "xl/workbook.xml": (
+                f'<workbook xmlns="{SPREADSHEET_NS}" xmlns:r="{OFFICE_REL_NS}">'
+                '<sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/></sheets></workbook>'
+            ),
+            "xl/_rels/workbook.xml.rels": (
+                f'<Relationships xmlns="{PACKAGE_REL_NS}">'
+                f'<Relationship Id="rId1" Type="{OFFICE_REL_NS}/worksheet" Target="worksheets/sheet1.xml"/>'
+                f'<Relationship Id="rId2" Type="{OFFICE_REL_NS}/styles" Target="styles.xml"/>'
+                '</Relationships>'
+            ),
+            "xl/styles.xml": (
+                f'<styleSheet xmlns="{SPREADSHEET_NS}">'
+                '<fonts count="2"><font><sz val="11"/><name val="Calibri"/><family val="2"/><scheme val="minor"/></font>'
+                '<font><b/><sz val="11"/><name val="Calibri"/><family val="2"/><scheme val="minor"/></font></fonts>'
+                f'<fills count="{len(fill_colors) + 2}">'
+                '<fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill>'
+                f'{fills}</fills>'
+                '<borders count="2"><border><left/><right/><top/><bottom/><diagonal/></border>'
+                '<border><left style="thin"/><right style="thin"/><top style="thin"/><bottom style="thin"/><diagonal/></border></borders>'
+                '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+                f'<cellXfs count="{len(fill_colors) + 2}"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>{fill_xfs}'
+                '<xf numFmtId="0" fontId="1" fillId="0" borderId="1" xfId="0" applyFont="1" applyBorder="1" applyAlignment="1">'
+                '<alignment horizontal="center" vertical="top"/></xf></cellXfs>'
+                '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+                '</styleSheet>'
+            ),
+        }
+
+        self._zip = zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED, compresslevel=XLSX_COMPRESS_LEVEL)
+        for name, xml in parts.items():
+            self._zip.writestr(name, XML_DECLARATION + xml)
+        # The sheet size is unknown up front; without zip64 its entry cannot pass 2 GiB
+        self._sheet   = self._zip.open("xl/worksheets/sheet1.xml", "w", force_zip64=True)
+        self._pending = [XML_DECLARATION, f'<worksheet xmlns="{SPREADSHEET_NS}"><sheetData>']
+        self._row     = 0
+        self._columns = []
+
+    def write_row(self, values, style=0):
+        """
+        Append one row of values. style is 0 (no style), one of fill_styles or
+        header_style for the whole row, or a sequence of those, one per cell.
+        """
+        self._row += 1
+        row = self._row
+        if len(values) > len(self._columns):
+            self._columns += [column_letter(i) for i in range(len(self._columns), len(values))]
+        if isinstance(style, int):
+            attrs = [self._style_attrs[style]] * len(values)
+        else:
+            attrs = [self._style_attrs[cell_style] for cell_style in style]
+        cells = "".join(
+            f'<c r="{col}{row}"{s} t="inlineStr"><is><t xml:space="preserve">{xml_text(value)}</t></is></c>'
+            if value is not None and value != "" else f'<c r="{col}{row}"{s}/>'
+            for col, s, value in zip(self._columns, attrs, values)
+        )
+        self._pending.append(f'<row r="{row}">{cells}</row>')
+        if len(self._pending) >= self.FLUSH_ROWS:
+            self._flush()
+
+    def _flush(self):
+        self._sheet.write("".join(self._pending).encode("utf-8"))
+        self._pending = []
+
+    def close(self):
+        """Finish the sheet and the zip; the buffer then holds a complete xlsx."""
+        self._pending.append("</sheetData></worksheet>")
+        self._flush()
+        self._sheet.close()
+        self._zip.close()
+
+# ---------- Log lines ----------
+class LogLines(Sequence):
+    """
+    Read-only list of log lines backed by the row loop's (template, row, ...) events.
+    A line is only formatted when it is read; the app shows the last 20.
+    """
+    def __init__(self, events):
+        self._events = events
+
+    def __len__(self):
+        return len(self._events)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [event[0] % event[1:] for event in self._events[index]]
+        event = self._events[index]
+        return event[0] % event[1:]
+
+# ---------- Master index ----------
+def build_master_index(master_bytes: bytes, master_filename: str = "master.xlsx") -> dict:
+    """
+    Read and normalize the master file and build every lookup structure matching needs.
+    Depends on the master file only, so callers can cache it and reuse it across
+    output files. process_files never mutates it.
+    """
+    master_orig = read_uploaded(master_bytes, master_filename)
+
+    master_lp_col  = find_column_ignore_case(master_orig, "lp name")
+    master_fund_col = find_column_ignore_case(master_orig, "fund name")
+    master_cons_col = find_column_ignore_case(master_orig, "consultant")
+
+    # ---------- Normalize master ----------
+    # LP and consultant names repeat across thousands of rows, so they are interned:
+    # equal names share one string object and the factorize hash table below
+    # compares them by identity. Fund names are high-cardinality and left alone.
+    # Every normalizer runs once per distinct value (normalize_unique).
+    master_lp_norm   = [sys.intern(v) for v in normalize_unique(master_orig[master_lp_col], normalize_lp_cons_series)]
+    master_fund_norm = normalize_unique(master_orig[master_fund_col], normalize_fund_series)
+    master_cons_norm = [sys.intern(v) for v in normalize_unique(master_orig[master_cons_col], normalize_lp_cons_series)]
+    master_fund_orig = master_orig[master_fund_col].fillna("").astype(str)
+
+    # LP/LLC-aware structures
+    master_fund_stripped = normalize_unique(master_fund_norm, strip_lp_llc_series).tolist()
+    master_fund_has_lp   = normalize_unique(master_fund_orig, has_lp_llc_series).tolist()
+    # Plain lists from here on: the index build below iterates them element by element
+    master_fund_orig     = master_fund_orig.tolist()
+
+    # ---------- Integer-encode keys ----------
+    # lp, consultant and stripped fund names are factorized, so group and
+    # exact-match keys are single ints instead of tuples of strings. Output rows
+    # are looked up against the same indexes (lookup_ids).
+    master_lp_ids,   lp_index   = factorize_master(master_lp_norm)
+    master_cons_ids, cons_index = factorize_master(master_cons_norm)
+    master_fund_ids, fund_index = factorize_master(master_fund_stripped)
+
+    master_group_keys, master_exact_keys = encode_keys(
+        master_lp_ids, master_cons_ids, master_fund_ids, master_fund_has_lp,
+        len(cons_index), len(fund_index)
+    )
+    master_fund_ids = master_fund_ids.tolist()
+
+    # Word tokens as sorted integer ids, so RapidFuzz can score long candidate lists
+    # in C (see batch_jaccard). Tokenized once per distinct stripped name (fund id).
+    token_ids            = {}
+    tokens_by_fund_id    = [token_id_sequence(name, token_ids) for name in fund_index]
+    token_set_by_fund_id = [frozenset(tokens) for tokens in tokens_by_fund_id]
+
+    # ---------- Build lookup maps ----------
+    # Exact key: stripped fund + LP/LLC presence flag (later master rows win)
+    # "Blackrock L.P." and "Blackrock LP" -> same stripped name, both have LP -> Exact
+    # "Blackrock LP" vs "Blackrock"        -> LP flag differs -> falls to Partial
+    # Held as a Series on a unique int64 index, so output rows are joined against
+    # it in one reindex (a hash join in Cython) without rebuilding a table per run.
+    exact_lookup = pd.Series(master_fund_orig, index=pd.Index(master_exact_keys, dtype=np.int64), dtype=object)
+    exact_lookup = exact_lookup[~exact_lookup.index.duplicated(keep="last")]
+
+    # Per (lp, cons) group, parallel lists (structure of arrays) in master order:
+    # (stripped names, LP/LLC flags, token sets, token id sequences, original names)
+    # Built CSR style: a stable sort on the group key lays every group out
+    # contiguously in master order, so each group's lists are plain slices.
+    group_key_arr = np.asarray(master_group_keys, dtype=np.int64)
+    order         = np.argsort(group_key_arr, kind="stable")
+    group_keys, group_starts = np.unique(group_key_arr[order], return_index=True)
+    group_bounds  = group_starts.tolist() + [len(order)]
+
+    sorted_fund_ids  = np.asarray(master_fund_ids, dtype=np.int64)[order].tolist()
+    sorted_strippeds = np.asarray(master_fund_stripped, dtype=object)[order].tolist()
+    sorted_has_lps   = np.asarray(master_fund_has_lp, dtype=object)[order].tolist()
+    sorted_origs     = np.asarray(master_fund_orig, dtype=object)[order].tolist()
+
+    funds_by_lp_cons = {}
+    # Per (lp, cons) group: ({token id: [positions]}, {stripped fund id: first position}).
+    # Lets the partial pass visit only candidates that can possibly qualify
+    # instead of scoring every fund in the group. One flat list per token keeps
+    # the (cached) index small; token counts are read off token_seqs at scan time.
+    postings_by_lp_cons = {}
+    for group_key, start, end in zip(group_keys.tolist(), group_bounds, group_bounds[1:]):
+        fund_ids   = sorted_fund_ids[start:end]
+        strippeds  = sorted_strippeds[start:end]
+        token_seqs = [tokens_by_fund_id[fund_id] for fund_id in fund_ids]
+        funds_by_lp_cons[group_key] = (
+            strippeds, sorted_has_lps[start:end],
+            [token_set_by_fund_id[fund_id] for fund_id in fund_ids],
+            token_seqs, sorted_origs[start:end],
+        )
+
+        token_postings, stripped_first = {}, {}
+        for pos, (fund_id, fund_stripped, fund_tokens) in enumerate(zip(fund_ids, strippeds, token_seqs)):
+            for tok in fund_tokens:
+                token_postings.setdefault(tok, []).append(pos)
+            if fund_stripped:
+                stripped_first.setdefault(fund_id, pos)
+        postings_by_lp_cons[group_key] = (token_postings, stripped_first)
+
+    return {
+        "lp_index":             lp_index,
+        "cons_index":           cons_index,
+        "fund_index":           fund_index,
+        "token_ids":            token_ids,
+        "tokens_by_fund_id":    tokens_by_fund_id,
+        "token_set_by_fund_id": token_set_by_fund_id,
+        "exact_lookup":         exact_lookup,
+        "funds_by_lp_cons":     funds_by_lp_cons,
+        "postings_by_lp_cons":  postings_by_lp_cons,
+    }
 
 def process_files(master_bytes: bytes, output_bytes: bytes,
                   master_filename: str = "master.xlsx",
                   output_filename: str = "output.xlsx",
-                  similarity_threshold: float = PARTIAL_SIMILARITY_THRESHOLD):
+                  similarity_threshold: float = PARTIAL_SIMILARITY_THRESHOLD,
+                  master_index: dict = None):
     """
     Run fund matching.
     Inputs: file bytes + filenames (to detect CSV vs Excel).
+            master_index: optional build_master_index() result for master_bytes,
+            e.g. cached by the caller; built here when omitted.
     Returns: (BytesIO result_xlsx, stats dict)
 
     Matching logic:
@@ -92,144 +616,173 @@ def process_files(master_bytes: bytes, output_bytes: bytes,
     - No Match: everything else
     """
 
-    # ---------- Read DataFrames ----------
-    master_orig = read_uploaded(master_bytes, master_filename)
+    # ---------- Master index ----------
+    if master_index is None:
+        master_index = build_master_index(master_bytes, master_filename)
+    fund_index           = master_index["fund_index"]
+    tokens_by_fund_id    = master_index["tokens_by_fund_id"]
+    token_set_by_fund_id = master_index["token_set_by_fund_id"]
+    exact_lookup         = master_index["exact_lookup"]
+    funds_by_lp_cons     = master_index["funds_by_lp_cons"]
+    postings_by_lp_cons  = master_index["postings_by_lp_cons"]
+
+    # ---------- Read output ----------
     output_orig = read_uploaded(output_bytes, output_filename)
 
-    # ---------- Locate required columns ----------
-    master_lp_col  = find_column_ignore_case(master_orig, "lp name")
-    master_fund_col = find_column_ignore_case(master_orig, "fund name")
-    master_cons_col = find_column_ignore_case(master_orig, "consultant")
-
     output_lp_col  = find_column_ignore_case(output_orig, "lpname")
     output_fund_col = find_column_ignore_case(output_orig, "fundname")
     output_cons_col = find_column_ignore_case(output_orig, "reportingconsultant")
 
-    # ---------- Build normalized master structures ----------
-    master_lp_norm   = master_orig[master_lp_col].fillna("").apply(normalize_lp_cons)
-    master_fund_norm = master_orig[master_fund_col].fillna("").apply(normalize_fund)
-    master_cons_norm = master_orig[master_cons_col].fillna("").apply(normalize_lp_cons)
-    master_fund_orig = master_orig[master_fund_col].fillna("").astype(str)
-
-    # LP/LLC-aware structures
-    master_fund_raw      = master_orig[master_fund_col].fillna("").astype(str)
-    master_fund_stripped = master_fund_raw.apply(lambda v: strip_lp_llc(normalize_fund(v)))
-    master_fund_has_lp   = master_fund_raw.apply(lambda v: has_lp_llc(str(v)))
-
-    exact_map        = {}
-    funds_by_lp_cons = defaultdict(list)
-    for lp_n, fund_n, fund_stripped, fund_has_lp, cons_n, fund_orig in zip(
-        master_lp_norm, master_fund_norm, master_fund_stripped,
-        master_fund_has_lp, master_cons_norm, master_fund_orig
-    ):
-        # Exact key: stripped fund + LP/LLC presence flag
-        # "Blackrock L.P." and "Blackrock LP" -> same stripped name, both have LP -> Exact
-        # "Blackrock LP" vs "Blackrock"        -> LP flag differs -> falls to Partial
-        exact_map[(lp_n, fund_stripped, cons_n, fund_has_lp)] = fund_orig
-        funds_by_lp_cons[(lp_n, cons_n)].append((fund_n, fund_stripped, fund_has_lp, fund_orig))
-
     # ---------- Normalize output ----------
-    output_lp_norm   = output_orig[output_lp_col].fillna("").apply(normalize_lp_cons).tolist()
-    output_fund_norm = output_orig[output_fund_col].fillna("").apply(normalize_fund).tolist()
-    output_cons_norm = output_orig[output_cons_col].fillna("").apply(normalize_lp_cons).tolist()
-
-    output_fund_raw      = output_orig[output_fund_col].fillna("").astype(str).tolist()
-    output_fund_stripped = [strip_lp_llc(normalize_fund(v)) for v in output_fund_raw]
-    output_fund_has_lp   = [has_lp_llc(v) for v in output_fund_raw]
-
-    # ---------- Create workbook ----------
-    tmp_buffer = BytesIO()
-    output_orig.to_excel(tmp_buffer, index=False)
-    tmp_buffer.seek(0)
-    wb = load_workbook(tmp_buffer)
-    ws = wb.active
-
-    GREEN  = PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid")
-    YELLOW = PatternFill(start_color="FFF2CC", end_color="FFF2CC", fill_type="solid")
-    RED    = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
-
-    masterentity_col = ws.max_column + 1
-    flag_col         = masterentity_col + 1
-
-    ws.cell(row=1, column=masterentity_col).value = "masterentity"
-    ws.cell(row=1, column=flag_col).value         = "flag"
+    total           = len(output_orig)
+    output_lp_raw   = output_orig[output_lp_col]
+    output_fund_raw = output_orig[output_fund_col]
+    output_cons_raw = output_orig[output_cons_col]
+
+    output_lp_norm       = normalize_unique(output_lp_raw, normalize_lp_cons_series)
+    output_cons_norm     = normalize_unique(output_cons_raw, normalize_lp_cons_series)
+    output_fund_norm     = normalize_unique(output_fund_raw, normalize_fund_series)
+    output_fund_stripped = normalize_unique(output_fund_norm, strip_lp_llc_series).tolist()
+    output_fund_has_lp   = normalize_unique(output_fund_raw, has_lp_llc_series).tolist()
+
+    # ---------- Integer-encode keys against the master index ----------
+    output_fund_ids = lookup_ids(fund_index, output_fund_stripped)
+    output_group_keys, output_exact_keys = encode_keys(
+        lookup_ids(master_index["lp_index"], output_lp_norm),
+        lookup_ids(master_index["cons_index"], output_cons_norm),
+        output_fund_ids, output_fund_has_lp,
+        len(master_index["cons_index"]), len(fund_index)
+    )
+    output_fund_ids = output_fund_ids.tolist()
+
+    # ---------- Exact matching (vectorized) ----------
+    # One hash join of the output's integer exact keys against the master's;
+    # None where a row has no exact match.
+    exact_matches = exact_lookup.reindex(pd.Index(output_exact_keys, dtype=np.int64))
+    exact_matches = exact_matches.astype(object).where(exact_matches.notna(), None).tolist()
+
+    # Fund names master lacks are tokenized once each against a private copy of
+    # the token vocabulary, so a cached master index is never mutated
+    unseen_fund_tokens = {}
+    unseen_names = {name for name, fund_id in zip(output_fund_stripped, output_fund_ids) if fund_id < 0}
+    if unseen_names:
+        token_ids = dict(master_index["token_ids"])
+        for name in unseen_names:
+            tokens = token_id_sequence(name, token_ids)
+            unseen_fund_tokens[name] = (tokens, frozenset(tokens))
+
+    # ---------- Create result workbook ----------
+    # Rows are streamed to the xlsx by StreamingSheetWriter, so no cell objects pile up
+    result_buffer = BytesIO()
+    sheet = StreamingSheetWriter(result_buffer, ("C6EFCE", "FFF2CC", "FFC7CE"))
+    GREEN, YELLOW, RED = sheet.fill_styles
 
     exact_count    = 0
     partial_count  = 0
     no_match_count = 0
-    log_lines      = []
-
-    total = len(output_orig)
-    t0    = time.time()
-
+    log_events     = []
+
+    t0 = time.time()
+
+    # ---------- Partial matching (bulk) ----------
+    # One pass picks the rows with no exact hit whose (lp, cons) group has master
+    # funds to compare against, and builds their queries.
+    # Output files repeat the same (lp, cons, fund) across line items; the outcome
+    # only depends on that key, so each distinct one is matched once and shared.
+    # Keys that cannot match at all get slot -1 and are never queried.
+    query_slots     = {}
+    partial_queries = []
+    partial_rows    = []
+    row_slots       = []
+    for i, (group_key, exact_match) in enumerate(zip(output_group_keys, exact_matches)):
+        if exact_match is not None or group_key not in funds_by_lp_cons:
+            continue
+        partial_rows.append(i)
+        query_key = (group_key, output_fund_stripped[i], output_fund_has_lp[i])
+        slot      = query_slots.get(query_key)
+        if slot is None:
+            fund_id = output_fund_ids[i]
+            if fund_id >= 0:
+                tokens, token_set = tokens_by_fund_id[fund_id], token_set_by_fund_id[fund_id]
+            else:
+                tokens, token_set = unseen_fund_tokens[output_fund_stripped[i]]
+
+            # Prefilter: with a positive threshold a candidate needs a shared word
+            # (Jaccard > 0) or the same stripped name (Case A). If the group's word
+            # vocabulary misses every query word, nothing in it can qualify.
+            token_postings, stripped_first = postings_by_lp_cons[group_key]
+            if (similarity_threshold > 0 and fund_id not in stripped_first
+                    and token_postings.keys().isdisjoint(tokens)):
+                slot = query_slots[query_key] = -1
+            else:
+                slot = query_slots[query_key] = len(partial_queries)
+                partial_queries.append((
+                    output_fund_stripped[i], output_fund_has_lp[i], fund_id,
+                    tokens, token_set, group_key
+                ))
+        row_slots.append(slot)
+    query_matches   = match_partial_queries(partial_queries, funds_by_lp_cons, postings_by_lp_cons, similarity_threshold)
+    partial_matches = {i: query_matches[slot] for i, slot in zip(partial_rows, row_slots) if slot >= 0}
+
+    # ---------- Resolve every row (match phase) ----------
+    # Only plain lists are touched here; the workbook is written afterwards.
+    # Defaults are the No Match outcome: blank masterentity, red row
+    masterentity_values = [""] * total
+    flag_values         = ["No Match"] * total
+    row_styles          = [RED] * total
+
+    log_event = log_events.append  # hoisted out of the per-row loop
     for i in range(total):
-        excel_row  = i + 2
-        lp         = output_lp_norm[i]
-        fund       = output_fund_norm[i]
-        cons       = output_cons_norm[i]
-        f_stripped = output_fund_stripped[i]
-        f_has_lp   = output_fund_has_lp[i]
-
-        matched_original_fund = None
+        excel_row = i + 2
+
+        matched_original_fund = exact_matches[i]
         fill_color            = None
         flag_value            = None
 
         # --- Exact match ---
-        if (lp, f_stripped, cons, f_has_lp) in exact_map:
-            matched_original_fund = exact_map[(lp, f_stripped, cons, f_has_lp)]
+        if matched_original_fund is not None:
             fill_color = GREEN
             flag_value = "Exact"
             exact_count += 1
-            log_lines.append(f"Row {excel_row} | Exact -> {matched_original_fund}")
+            log_event((LOG_EXACT, excel_row, matched_original_fund))
 
         else:
             # --- Partial match ---
-            candidates = funds_by_lp_cons.get((lp, cons), [])
-            for cand_norm, cand_stripped, cand_has_lp, cand_orig in candidates:
-
-                # Case A: LP/LLC mismatch only — stripped names are identical, LP presence differs
-                if f_stripped and cand_stripped and f_stripped == cand_stripped and f_has_lp != cand_has_lp:
-                    matched_original_fund = cand_orig
-                    fill_color = YELLOW
-                    flag_value = "Partial"
-                    partial_count += 1
-                    log_lines.append(f"Row {excel_row} | Partial (LP mismatch) -> {matched_original_fund}")
-                    break
-
-                # Case B: Word-overlap similarity >= threshold (replaces loose substring match)
-                # Uses stripped names so LP/LLC tokens don't inflate the score
-                similarity = word_jaccard(f_stripped, cand_stripped)
-                if similarity >= similarity_threshold:
-                    matched_original_fund = cand_orig
-                    fill_color = YELLOW
-                    flag_value = "Partial"
-                    partial_count += 1
-                    log_lines.append(
-                        f"Row {excel_row} | Partial (similarity={similarity:.2f}) -> {matched_original_fund}"
-                    )
-                    break
-
-        # --- Write masterentity and flag columns ---
+            match = partial_matches.get(i)
+            if match is not None:
+                matched_original_fund, similarity = match
+                fill_color = YELLOW
+                flag_value = "Partial"
+                partial_count += 1
+                if similarity is None:
+                    log_event((LOG_PARTIAL_LP, excel_row, matched_original_fund))
+                else:
+                    log_event((LOG_PARTIAL_SIMILAR, excel_row, similarity, matched_original_fund))
+
+        # --- Record masterentity, flag and highlight ---
         if matched_original_fund:
-            ws.cell(row=excel_row, column=masterentity_col).value = matched_original_fund
-            ws.cell(row=excel_row, column=flag_col).value         = flag_value
+            masterentity_values[i] = matched_original_fund
+            flag_values[i]         = flag_value
+            row_styles[i]          = fill_color
         else:
-            ws.cell(row=excel_row, column=masterentity_col).value = ""  # blank for No Match
-            ws.cell(row=excel_row, column=flag_col).value         = "No Match"
-            fill_color = RED
             no_match_count += 1
-            log_lines.append(f"Row {excel_row} | No Match")
-
-        # --- Apply row highlight ---
-        if fill_color:
-            for col in range(1, ws.max_column + 1):
-                ws.cell(row=excel_row, column=col).fill = fill_color
+            log_event((LOG_NO_MATCH, excel_row))
+
+    # ---------- Write rows (write phase) ----------
+    # Output columns keep pandas' to_excel header style; the two added ones are plain
+    write_row = sheet.write_row
+    write_row([*output_orig.columns, "masterentity", "flag"],
+              [sheet.header_style] * len(output_orig.columns) + [0, 0])
+    for row_values, masterentity, flag, style in zip(
+        output_orig.fillna("").to_numpy(dtype=object).tolist(),
+        masterentity_values, flag_values, row_styles
+    ):
+        write_row(row_values + [masterentity, flag], style)
 
     elapsed = time.time() - t0
 
     # ---------- Save workbook into BytesIO ----------
-    result_buffer = BytesIO()
-    wb.save(result_buffer)
+    sheet.close()
     result_buffer.seek(0)
 
     # ---------- Stats ----------
@@ -239,7 +792,7 @@ def process_files(master_bytes: bytes, output_bytes: bytes,
         "nomatch": no_match_count,
         "rows":    total,
         "elapsed": elapsed,
-        "log_lines": log_lines,
+        "log_lines": LogLines(log_events),
     }
 
     return result_buffer, stats
@@ -0,0 +1,168 @@
+# test_matching.py
+import io
+import random
+import unittest
+import xml.etree.ElementTree as ET
+import zipfile
+from collections import defaultdict
+from unittest import mock
+
+import pandas as pd
+
+import matching
+from matching import (
+    normalize_lp_cons, normalize_fund, strip_lp_llc, has_lp_llc,
+    tokenize, set_jaccard, process_files, read_uploaded, StreamingSheetWriter,
+)
+
+# ---------- Random inputs ----------
+# Few LPs / consultants, so groups are large enough for every partial-match path
+WORDS    = ["alpha", "beta", "capital", "partners", "growth", "equity", "fund", "the",
+            "of", "ventures", "global", "ii", "iii", "iv", "opportunities", "credit"]
+SUFFIXES = ["", " LP", " L.P.", ", LLC", " llc", ","]
+LPS      = ["Calpers", "CalSTRS  ", "texas teachers", ""]
+CONS     = ["Cambridge", "  Meketa", ""]
+
+def random_fund(rng):
+    name = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 4)))
+    if rng.random() < 0.3:
+        name = name.title()
+    return name + rng.choice(SUFFIXES)
+
+def random_files(seed, n_master=150, n_output=300):
+    rng    = random.Random(seed)
+    master = pd.DataFrame({
+        "LP Name":    [rng.choice(LPS) for _ in range(n_master)],
+        "Fund Name":  [random_fund(rng) for _ in range(n_master)],
+        "Consultant": [rng.choice(CONS) for _ in range(n_master)],
+    })
+    rows = []
+    for _ in range(n_output):
+        if rng.random() < 0.4:
+            lp, fund, cons = master.iloc[rng.randrange(n_master)]
+            fund += rng.choice(SUFFIXES)
+        else:
+            lp, fund, cons = rng.choice(LPS), random_fund(rng), rng.choice(CONS)
+        rows.append({"lpname": lp, "FundName": fund, "ReportingConsultant": cons})
+    return master, pd.DataFrame(rows)
+
+def csv_bytes(df):
+    buffer = io.BytesIO()
+    df.to_csv(buffer, index=False)
+    return buffer.getvalue()
+
+# ---------- Reference: the plain row loop, scalar helpers only ----------
+def reference_matches(master, output, similarity_threshold):
+    """
+    ((masterentity, flag) per output row, log lines), matched one master row at a time.
+    The log lines tell a Case A hit from a Case B hit on the same candidate.
+    """
+    exact_map        = {}
+    funds_by_lp_cons = defaultdict(list)
+    for lp, fund, cons in master.fillna("").itertuples(index=False):
+        stripped = strip_lp_llc(normalize_fund(fund))
+        group    = (normalize_lp_cons(lp), normalize_lp_cons(cons))
+        exact_map[group + (stripped, has_lp_llc(fund))] = fund
+        funds_by_lp_cons[group].append((stripped, has_lp_llc(fund), fund))
+
+    results, log_lines = [], []
+    for row, (lp, fund, cons) in enumerate(output.fillna("").itertuples(index=False), start=2):
+        f_stripped = strip_lp_llc(normalize_fund(fund))
+        f_has_lp   = has_lp_llc(fund)
+        group      = (normalize_lp_cons(lp), normalize_lp_cons(cons))
+        match, flag = exact_map.get(group + (f_stripped, f_has_lp)), "Exact"
+        line = f"Row {row} | Exact -> {match}"
+        if match is None:
+            flag = "Partial"
+            for cand_stripped, cand_has_lp, cand_orig in funds_by_lp_cons.get(group, []):
+                if f_stripped and cand_stripped and f_stripped == cand_stripped and f_has_lp != cand_has_lp:
+                    match = cand_orig
+                    line  = f"Row {row} | Partial (LP mismatch) -> {match}"
+                    break
+                similarity = set_jaccard(set(tokenize(f_stripped)), set(tokenize(cand_stripped)))
+                if similarity >= similarity_threshold:
+                    match = cand_orig
+                    line  = f"Row {row} | Partial (similarity={similarity:.2f}) -> {match}"
+                    break
+        if match:
+            results.append((match, flag))
+        else:
+            results.append(("", "No Match"))
+            line = f"Row {row} | No Match"
+        log_lines.append(line)
+    return results, log_lines
+
+def result_matches(result_buffer):
+    result = pd.read_excel(result_buffer, dtype=str, engine="calamine").fillna("")
+    return list(zip(result["masterentity"], result["flag"]))
+
+class PartialMatchPathsTest(unittest.TestCase):
+    """The head scan, the RapidFuzz tail and the per-group cdist all give the reference result."""
+
+    THRESHOLDS = (0, 0.34, 0.75, 1.0)
+
+    def check_against_reference(self, **constants):
+        for seed in range(3):
+            master, output = random_files(seed)
+            for threshold in self.THRESHOLDS:
+                with self.subTest(seed=seed, threshold=threshold), \
+                        mock.patch.multiple(matching, **constants):
+                    result, stats = process_files(
+                        csv_bytes(master), csv_bytes(output), "master.csv", "output.csv",
+                        similarity_threshold=threshold,
+                    )
+                    expected, expected_log = reference_matches(master, output, threshold)
+                    self.assertEqual(result_matches(result), expected)
+                    self.assertEqual(list(stats["log_lines"]), expected_log)
+                    self.assertEqual(stats["rows"], len(output))
+
+    def test_paths_forced_low(self):
+        self.check_against_reference(BATCH_SCORE_MIN_CANDIDATES=2, GROUP_BATCH_MIN_QUERIES=2,
+                                     GROUP_BATCH_MAX_CELLS=7)
+
+    def test_tail_scoring_without_group_batches(self):
+        self.check_against_reference(BATCH_SCORE_MIN_CANDIDATES=2, GROUP_BATCH_MIN_QUERIES=10**9)
+
+    def test_paths_forced_high(self):
+        self.check_against_reference(BATCH_SCORE_MIN_CANDIDATES=10**9, GROUP_BATCH_MIN_QUERIES=10**9)
+
+class ReadUploadedTest(unittest.TestCase):
+
+    def test_csv_cells_keep_their_text(self):
+        raw   = ["007", "00123", "1.50", "0.10", "1e5", "12345678901234567890", "TRUE", "1"]
+        data  = "Id,lpname,fundname,\n" + "".join(f"{v},{v},{v},x\n" for v in raw)
+        frame = read_uploaded(data.encode("utf-8"), "output.csv")
+        self.assertEqual(list(frame.columns), ["Id", "lpname", "fundname", "Unnamed: 3"])
+        for col in ("Id", "lpname", "fundname"):
+            self.assertEqual(frame[col].tolist(), raw)
+
+    def test_csv_output_matches_xlsx_master_by_text(self):
+        master = pd.DataFrame({"LP Name": ["00123"], "Fund Name": ["007 Growth LP"], "Consultant": ["0.10"]})
+        output = pd.DataFrame({"lpname": ["00123"], "FundName": ["007 growth lp"], "ReportingConsultant": ["0.10"]})
+        master_buffer = io.BytesIO()
+        master.to_excel(master_buffer, index=False)
+        _, stats = process_files(master_buffer.getvalue(), csv_bytes(output), "master.xlsx", "output.csv")
+        self.assertEqual(stats["exact"], 1)
+
+class StreamingSheetWriterTest(unittest.TestCase):
+
+    def test_escaping_round_trip(self):
+        values = ["a&b<c>d", "a\r\nb", "\r", "ctl\x01\x0b", "_x0041_", "_x0041_x0042_",
+                  "_x005F_", "tab\tand\nnewline", "é漢字"]
+        buffer = io.BytesIO()
+        sheet  = StreamingSheetWriter(buffer, ("C6EFCE",))
+        for value in values + ["a￾b￿"]:
+            sheet.write_row([value], sheet.fill_styles[0])
+        sheet.close()
+
+        # Every part is well-formed XML, U+FFFE / U+FFFF included
+        with zipfile.ZipFile(io.BytesIO(buffer.getvalue())) as package:
+            for name in package.namelist():
+                ET.fromstring(package.read(name))
+
+        buffer.seek(0)
+        read_back = pd.read_excel(buffer, header=None, dtype=str, engine="calamine")[0].tolist()
+        self.assertEqual(read_back[:len(values)], values)
+
+if __name__ == "__main__":
+    unittest.main()